@@ -1,164 +1,362 @@
-from fastapi import FastAPI, HTTPException, Path, Query
-from fastapi.responses import JSONResponse
-import json
-from pydantic import BaseModel, Field, computed_field
+from fastapi import FastAPI, HTTPException, Path, Query, Request, Response
+from fastapi.responses import ORJSONResponse
+import orjson
+import numpy as np
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
 from typing import List, Annotated,Literal, Optional
+import os
+import asyncio
+import time
+import sqlite3
+import mmap
+import contextlib
+import logging
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+_BMI_CATEGORIES = ("Underweight", "Normal weight", "Overweight", "Obesity")
+
+
+def categorize_bmi(bmi: float) -> str:
+    # each threshold passed adds one to the index, no compare chain
+    return _BMI_CATEGORIES[(bmi >= 18.5) + (bmi >= 24.9) + (bmi >= 29.9)]
+
+
+def with_bmi(row: dict) -> dict:
+    # bmi and bmi_category are computed once here, when a row is written, and stored with it
+    row['bmi'] = round(row['weight'] / (row['height'] ** 2), 2)
+    row['bmi_category'] = categorize_bmi(row['bmi'])
+    return row
+
 
 class Patient(BaseModel):
+    # bmi and bmi_category sent by clients are ignored and recomputed by with_bmi
+    model_config = ConfigDict(extra='ignore')
+
     id: Annotated[str, Field(...,description="The ID of the patient", example="P001")]
     name: Annotated[str, Field(...,description="The name of the patient")]
     city: Annotated[str, Field(...,description="The city of the patient")]
     age: Annotated[int, Field(...,ge=0,le=120,description="The age of the patient")]
     gender: Annotated[Literal["male","female","other"], Field(...,description="The gender of the patient")]
-    height: Annotated[float, Field(...,ge=0,description="The height of the patient in Meters")]
+    height: Annotated[float, Field(...,gt=0,description="The height of the patient in Meters")]
     weight: Annotated[float, Field(...,ge=0,description="The weight of the patient in Kilograms")]
 
-    @computed_field
-    @property
-    def bmi(self) -> float:
-        return round(self.weight / (self.height ** 2), 2)
-
-    @computed_field
-    @property
-    def bmi_category(self) -> str:
-        if self.bmi < 18.5:
-            return "Underweight"
-        elif self.bmi < 24.9:
-            return "Normal weight"
-        elif self.bmi < 29.9:
-            return "Overweight"
-        else:
-            return "Obesity"
-
 
 class PatientUpdate(BaseModel):
+    model_config = ConfigDict(extra='ignore')
+
     name: Annotated[Optional[str], Field(default=None)]
     city: Annotated[Optional[str], Field(default=None)]
     age: Annotated[Optional[int], Field(default=None, ge=0, le=120)]
     gender: Annotated[Optional[Literal["male","female","other"]], Field(default=None)]
-    height: Annotated[Optional[float], Field(default=None, ge=0)]
+    height: Annotated[Optional[float], Field(default=None, gt=0)]
     weight: Annotated[Optional[float], Field(default=None, ge=0)]
 
 
 
-app = FastAPI()
-
-def load_data():
-    with open("patients.json", "r") as file:
-        data = json.load(file)
+app = FastAPI(default_response_class=ORJSONResponse)
+
+DB_PATH = "patients.db"
+# seconds between checks for writes made to DB_PATH by other processes
+RELOAD_INTERVAL = 1.0
+
+_COLUMNS = ("name", "city", "age", "gender", "height", "weight", "bmi", "bmi_category")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS patients(
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    city TEXT NOT NULL,
+    age INTEGER NOT NULL,
+    gender TEXT NOT NULL,
+    height REAL NOT NULL,
+    weight REAL NOT NULL,
+    bmi REAL NOT NULL,
+    bmi_category TEXT NOT NULL
+);
+"""
+
+_SELECT_ALL = f"SELECT id, {', '.join(_COLUMNS)} FROM patients"
+_SELECT_ONE = f"SELECT {', '.join(_COLUMNS)} FROM patients WHERE id = ?"
+# plain INSERT so the primary key, not the in-memory cache, rejects a duplicate id
+_INSERT = f"INSERT INTO patients(id, {', '.join(_COLUMNS)}) VALUES ({', '.join('?' * (len(_COLUMNS) + 1))})"
+_UPDATE = f"UPDATE patients SET {', '.join(f'{column} = ?' for column in _COLUMNS)} WHERE id = ?"
+
+# in-memory copy of the patients table, loaded once at startup. Never mutated in place:
+# writers build a new dict and swap the reference, so readers need no lock
+_PATIENTS: dict = {}
+_DB: sqlite3.Connection | None = None
+# serializes writers: every use of _DB and every change to _PATIENTS
+_WRITE_LOCK = asyncio.Lock()
+# bumped on every write, used as the ETag of the GET endpoints
+_VERSION: int = 0
+# the sortable fields of _PATIENTS as parallel arrays, rebuilt on every write
+_soa: dict = {}
+# sorted views of _PATIENTS keyed by (sort_by, order), cleared on every write
+_sort_cache: dict[tuple[str, str], list] = {}
+# _PATIENTS already encoded for /view, re-encoded on every write
+_VIEW_BYTES: bytes = b"{}"
+_reload_task: asyncio.Task | None = None
+# set at shutdown; the reload task finishes its current check and exits
+_stop_reload: asyncio.Event | None = None
+
+def get_connection():
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+def load_json_data():
+    # decode straight from the mapped file instead of reading it into a bytes copy first
+    with open("patients.json", "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        with memoryview(mapped) as view:
+            rows = orjson.loads(view)
+
+    # validate row by row so one bad legacy row is skipped and reported instead of failing the whole import
+    data = {}
+    for patient_id, row in rows.items():
+        try:
+            data[patient_id] = Patient.model_validate({**row, 'id': patient_id}).model_dump(exclude=["id"])
+        except ValidationError as e:
+            logger.warning("Skipping patient %s from patients.json: %s", patient_id, e)
 
     return data
 
-def save_data(data):
-    with open("patients.json", "w") as file:
-        json.dump(data, file, indent=4)
+def load_data():
+    return {row[0]: dict(zip(_COLUMNS, row[1:])) for row in _DB.execute(_SELECT_ALL)}
+
+def insert_patient(patient_id, row):
+    # raises sqlite3.IntegrityError if the id is already taken
+    with _DB:
+        _DB.execute(_INSERT, (patient_id, *(row[column] for column in _COLUMNS)))
+
+def update_patient_row(patient_id, patient_update):
+    # merge onto the stored row, not the cached one, and hold the write lock from read to write
+    # so a change committed by another connection in between is neither lost nor undone.
+    # Returns the new row, or None if no such patient is stored
+    with _DB:
+        _DB.execute("BEGIN IMMEDIATE")
+        stored = _DB.execute(_SELECT_ONE, (patient_id,)).fetchone()
+        if stored is None:
+            return None
+        row = with_bmi({**dict(zip(_COLUMNS, stored)), **patient_update})
+        _DB.execute(_UPDATE, (*(row[column] for column in _COLUMNS), patient_id))
+        return row
+
+def remove_patient(patient_id):
+    # returns False if no such patient is stored
+    with _DB:
+        return _DB.execute("DELETE FROM patients WHERE id = ?", (patient_id,)).rowcount > 0
+
+def data_version():
+    # changes only when another connection commits, i.e. another worker or an external writer
+    return _DB.execute("PRAGMA data_version").fetchone()[0]
+
+def build_soa(patients):
+    count = len(patients)
+    return {
+        'id': list(patients),
+        'age': np.fromiter((row['age'] for row in patients.values()), dtype=np.int32, count=count),
+        'bmi': np.fromiter((row['bmi'] for row in patients.values()), dtype=np.float64, count=count),
+        'weight': np.fromiter((row['weight'] for row in patients.values()), dtype=np.float64, count=count),
+        'height': np.fromiter((row['height'] for row in patients.values()), dtype=np.float64, count=count),
+    }
+
+
+def not_modified(request: Request, etag: str):
+    # the client already holds this version, skip serializing the body
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return None
+
+
+def etag_response(etag: str, content):
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=0"}
+    if isinstance(content, bytes):
+        return Response(content=content, media_type="application/json", headers=headers)
+    return ORJSONResponse(content=content, headers=headers)
+
+
+def conditional_response(request: Request, etag: str, content):
+    return not_modified(request, etag) or etag_response(etag, content)
+
+
+@lru_cache(maxsize=4096)
+def encode_patient(patient_id: str, version: int) -> bytes:
+    # version is only part of the cache key: bumping _VERSION leaves older entries unreachable
+    return orjson.dumps(_PATIENTS[patient_id])
+
+
+def publish_patients(patients):
+    # swap in a new snapshot and rebuild everything derived from it
+    global _PATIENTS, _VERSION, _soa, _VIEW_BYTES
+    _PATIENTS = patients
+    _VERSION += 1
+    _soa = build_soa(_PATIENTS)
+    _VIEW_BYTES = orjson.dumps(_PATIENTS)
+    _sort_cache.clear()
+
+
+@app.on_event("startup")
+def load_patients():
+    global _DB, _VERSION
+    _DB = get_connection()
+    data = load_data()
+
+    # user_version records that the one-time import of the legacy patients.json has happened,
+    # so a table emptied by deletes is not refilled from the stale file on the next start
+    imported = _DB.execute("PRAGMA user_version").fetchone()[0] >= 1
+    if not imported and not data and os.path.exists("patients.json"):
+        data = load_json_data()
+
+        # recompute bmi and bmi_category exactly as add/update do; stored values in the file are not trusted
+        for row in data.values():
+            with_bmi(row)
+
+        with _DB:
+            _DB.executemany(_INSERT, [(patient_id, *(row[column] for column in _COLUMNS)) for patient_id, row in data.items()])
+        data = load_data()
+
+    if not imported:
+        with _DB:
+            _DB.execute("PRAGMA user_version = 1")
+
+    # start from a fresh value so ETags handed out before a restart never match
+    _VERSION = time.time_ns()
+    publish_patients(data)
+
+    # build the OpenAPI schema now instead of on the first /docs request
+    app.openapi()
+
+
+async def reload_on_external_writes():
+    async with _WRITE_LOCK:
+        last_version = await asyncio.to_thread(data_version)
+
+    while True:
+        # wait out the interval, waking early on shutdown
+        with contextlib.suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(_stop_reload.wait(), RELOAD_INTERVAL)
+        if _stop_reload.is_set():
+            break
+        # a failed check (e.g. "database is locked" while an external writer holds it) is retried next tick
+        try:
+            async with _WRITE_LOCK:
+                version = await asyncio.to_thread(data_version)
+                if version != last_version:
+                    publish_patients(await asyncio.to_thread(load_data))
+                    last_version = version
+        except Exception:
+            logger.exception("Reloading patients from %s failed", DB_PATH)
+
+
+@app.on_event("startup")
+async def start_reload_task():
+    global _reload_task, _stop_reload
+    # created here so it belongs to the running event loop
+    _stop_reload = asyncio.Event()
+    _reload_task = asyncio.create_task(reload_on_external_writes())
+
+
+@app.on_event("shutdown")
+async def close_db():
+    # cancelling would not stop a to_thread call already running on _DB, so ask the task
+    # to stop and wait for it before closing the connection under it
+    if _reload_task is not None:
+        _stop_reload.set()
+        await _reload_task
+    if _DB is not None:
+        _DB.close()
 
 
 @app.get("/")
-def hello():
+async def hello():
     return{'message': "Patients Management System"}
 
 @app.get("/about")
-def about():
+async def about():
     return{"message":"FastAPI server for Patient Management System"}
 
 
 @app.get("/view")
-def view():
-    data = load_data()
-    return data
+async def view(request: Request):
+    return conditional_response(request, f'W/"{_VERSION}"', _VIEW_BYTES)
 
 @app.get('/patient/{patient_id}')
-def view_patient(patient_id: str = Path(..., description='ID of the patient in the DB', example='P001')):
-    # load all the patients
-    data = load_data()
+async def view_patient(request: Request, patient_id: str = Path(..., description='ID of the patient in the DB', example='P001')):
+    data = _PATIENTS
 
     if patient_id in data:
-        return data[patient_id]
+        etag = f'W/"{_VERSION}-{patient_id}"'
+        # check the ETag before encoding, so a 304 never pays for orjson
+        return not_modified(request, etag) or etag_response(etag, encode_patient(patient_id, _VERSION))
     raise HTTPException(status_code=404, detail='Patient not found')
 
 @app.get('/sort')
-def sort_patients(sort_by: str = Query(..., description='Field to sort by', example='name'), 
-                  order: str = Query(..., description='Sort order', example='asc')):
-    valid_fields = ['age', 'bmi', 'weight', 'height']
-
-    if sort_by not in valid_fields:
-        raise HTTPException(status_code=400, detail=f'Invalid sort field. Must be one of: {", ".join(valid_fields)}')
-    
-    if order not in ['asc', 'desc']:
-        raise HTTPException(status_code=400, detail='Invalid order. Must be either "asc" or "desc"')
-    
-    data = load_data()
-    sort_order = True if order == 'asc' else False
-
-    sorted_data = sorted(data.values(), key=lambda x: x.get(sort_by, 0), reverse=sort_order)
-    return sorted_data
+async def sort_patients(request: Request,
+                        sort_by: Literal['age', 'bmi', 'weight', 'height'] = Query(..., description='Field to sort by', example='age'),
+                        order: Literal['asc', 'desc'] = Query(..., description='Sort order', example='asc')):
+    data, soa = _PATIENTS, _soa
+    key = (sort_by, order)
+    sorted_data = _sort_cache.get(key)
+    if sorted_data is None:
+        # negate for desc so rows with equal values keep their stable order
+        values = soa[sort_by] if order == 'asc' else -soa[sort_by]
+        ids = soa['id']
+        sorted_data = [data[ids[i]] for i in np.argsort(values, kind='stable').tolist()]
+        _sort_cache[key] = sorted_data
+    return conditional_response(request, f'W/"{_VERSION}"', sorted_data)
 
 
 @app.post('/add_patient')
-def add_patient(patient: Patient):
-
-    #load all the patients
-    data = load_data()
-
-    #check if the patient already exists
-    if patient.id in data:
-        raise HTTPException(status_code=400, detail='Patient already exists')
+async def add_patient(patient: Patient):
+    async with _WRITE_LOCK:
+        #add the patient to the database
+        row = with_bmi(patient.model_dump(exclude=["id"]))
+        try:
+            await asyncio.to_thread(insert_patient, patient.id, row)
+        except sqlite3.IntegrityError:
+            raise HTTPException(status_code=400, detail='Patient already exists')
+        publish_patients({**_PATIENTS, patient.id: row})
 
-    #add the patient to the database
-    data[patient.id] = patient.model_dump(exclude=["id"])
-    
-    #save the updated database
-    save_data(data)
-
-    return JSONResponse(content={"message": "Patient added successfully"}, status_code=201)
+    return ORJSONResponse(content={"message": "Patient added successfully"}, status_code=201)
 
 
 @app.put('/update_patient/{patient_id}')
-def update_patient(patient_id: str, patient: PatientUpdate):
-    #load all the patients
-    data = load_data()
+async def update_patient(patient_id: str, patient: PatientUpdate):
+    # Only the fields sent by the client, already validated by PatientUpdate
+    patient_update = patient.model_dump(exclude_unset=True, exclude_none=True)
 
-    #check if the patient exists
-    if patient_id not in data:
-        raise HTTPException(status_code=404, detail='Patient not found')
-    
-    existing_patient = data[patient_id].copy()  # Create a copy to avoid modifying original data
-    patient_update = patient.model_dump(exclude_unset=True)
-
-    # Update the existing patient data with new values
-    for key, value in patient_update.items():
-        if value is not None:
-            existing_patient[key] = value
-
-    try:
-        # Validate the updated data by creating a Patient object
-        existing_patient['id'] = patient_id
-        patient_data = Patient(**existing_patient)
-        
-        # If validation passes, update the database
-        update_data = patient_data.model_dump(exclude=["id"])
-        data[patient_id] = update_data
-        save_data(data)
-
-        return JSONResponse(content={"message": "Patient updated successfully"}, status_code=200)
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+    async with _WRITE_LOCK:
+        # The stored row was validated on insert and PatientUpdate enforces the same constraints,
+        # so the merged row is valid as is; only the computed fields need refreshing
+        update_data = await asyncio.to_thread(update_patient_row, patient_id, patient_update)
+        if update_data is None:
+            raise HTTPException(status_code=404, detail='Patient not found')
+        publish_patients({**_PATIENTS, patient_id: update_data})
+
+    return ORJSONResponse(content={"message": "Patient updated successfully"}, status_code=200)
 
 
 @app.delete('/delete_patient/{patient_id}')
-def delete_patient(patient_id: str):
-    #load all the patients
-    data = load_data()
+async def delete_patient(patient_id: str):
+    async with _WRITE_LOCK:
+        #delete the patient; the database decides whether it exists
+        if not await asyncio.to_thread(remove_patient, patient_id):
+            raise HTTPException(status_code=404, detail='Patient not found')
+        patients = dict(_PATIENTS)
+        patients.pop(patient_id, None)
+        publish_patients(patients)
+
+    return ORJSONResponse(content={"message": "Patient deleted successfully"}, status_code=200)
 
-    #check if the patient exists
-    if patient_id not in data:
-        raise HTTPException(status_code=404, detail='Patient not found')
-    
-    #delete the patient
-    del data[patient_id]
 
-    #save the updated database
-    save_data(data)
+if __name__ == "__main__":
+    import uvicorn
 
-    return JSONResponse(content={"message": "Patient deleted successfully"}, status_code=200)
+    # writes are checked against the database, but each worker serves reads from its own cache,
+    # which picks up other workers' writes only every RELOAD_INTERVAL seconds; run one by default
+    uvicorn.run("patients_main:app", host="0.0.0.0", port=8000, loop="uvloop", http="httptools",
+                workers=int(os.environ.get("WORKERS", 1)), log_level="warning")
@@ -0,0 +1,177 @@
+import contextlib
+import shutil
+import sqlite3
+import time
+from pathlib import Path
+
+import orjson
+import pytest
+from fastapi.testclient import TestClient
+
+import patients_main
+
+DATA_FILE = Path(__file__).resolve().parent.parent / "data" / "patients.json"
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    # the app reads patients.json and patients.db from the working directory
+    shutil.copy(DATA_FILE, tmp_path / "patients.json")
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def test_legacy_import_runs_only_once(workdir):
+    with TestClient(patients_main.app) as client:
+        patients = client.get("/view").json()
+        assert len(patients) == 6
+
+        for patient_id in patients:
+            assert client.delete(f"/delete_patient/{patient_id}").status_code == 200
+        assert client.get("/view").json() == {}
+
+    # restarting with patients.json still on disk must not bring the deleted rows back
+    with TestClient(patients_main.app) as client:
+        assert client.get("/view").json() == {}
+
+
+def test_zero_height_is_rejected(workdir):
+    patient = {"id": "P100", "name": "A", "city": "Pune", "age": 30, "gender": "male", "height": 0, "weight": 70}
+    with TestClient(patients_main.app) as client:
+        assert client.post("/add_patient", json=patient).status_code == 422
+        assert client.put("/update_patient/P001", json={"height": 0}).status_code == 422
+
+
+def test_imported_bmi_matches_write_path(workdir):
+    with TestClient(patients_main.app) as client:
+        for row in client.get("/view").json().values():
+            assert row == patients_main.with_bmi(dict(row))
+
+
+def test_invalid_legacy_row_is_skipped(workdir):
+    data = orjson.loads((workdir / "patients.json").read_bytes())
+    data["P002"]["gender"] = "Male"
+    (workdir / "patients.json").write_bytes(orjson.dumps(data))
+
+    with TestClient(patients_main.app) as client:
+        patients = client.get("/view").json()
+        assert "P002" not in patients
+        assert len(patients) == 5
+
+
+def test_patient_not_modified_skips_encoding(workdir):
+    with TestClient(patients_main.app) as client:
+        etag = client.get("/patient/P001").headers["etag"]
+        patients_main.encode_patient.cache_clear()
+
+        response = client.get("/patient/P001", headers={"if-none-match": etag})
+        assert response.status_code == 304
+        assert patients_main.encode_patient.cache_info().misses == 0
+
+
+def test_reload_survives_database_errors(workdir, monkeypatch):
+    monkeypatch.setattr(patients_main, "RELOAD_INTERVAL", 0.05)
+    calls = []
+    data_version = patients_main.data_version
+
+    def flaky_data_version():
+        calls.append(None)
+        if len(calls) == 2:
+            raise patients_main.sqlite3.OperationalError("database is locked")
+        return data_version()
+
+    monkeypatch.setattr(patients_main, "data_version", flaky_data_version)
+    with TestClient(patients_main.app):
+        deadline = time.monotonic() + 2
+        while len(calls) < 4 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert len(calls) >= 4
+        assert not patients_main._reload_task.done()
+
+
+def external_connection():
+    # a second connection standing in for another worker or an external writer
+    return sqlite3.connect(patients_main.DB_PATH)
+
+
+def test_add_and_delete_are_checked_against_the_database(workdir):
+    patient = {"id": "P100", "name": "Mine", "city": "Pune", "age": 30, "gender": "male", "height": 1.7, "weight": 70}
+    with TestClient(patients_main.app) as client:
+        with contextlib.closing(external_connection()) as conn, conn:
+            conn.execute(patients_main._INSERT, ("P100", "Theirs", "Delhi", 40, "female", 1.6, 60.0, 23.44, "Normal weight"))
+            conn.execute("DELETE FROM patients WHERE id = 'P001'")
+
+        assert client.post("/add_patient", json=patient).status_code == 400
+        assert client.delete("/delete_patient/P001").status_code == 404
+
+    with contextlib.closing(external_connection()) as conn:
+        assert conn.execute("SELECT name FROM patients WHERE id = 'P100'").fetchone() == ("Theirs",)
+
+
+def test_update_merges_onto_the_stored_row(workdir):
+    with TestClient(patients_main.app) as client:
+        with contextlib.closing(external_connection()) as conn, conn:
+            conn.execute("UPDATE patients SET city = 'Delhi' WHERE id = 'P002'")
+            conn.execute("DELETE FROM patients WHERE id = 'P001'")
+
+        assert client.put("/update_patient/P002", json={"age": 36}).status_code == 200
+        assert client.put("/update_patient/P001", json={"age": 36}).status_code == 404
+        assert client.get("/patient/P002").json()["city"] == "Delhi"
+
+    with contextlib.closing(external_connection()) as conn:
+        assert conn.execute("SELECT city, age FROM patients WHERE id = 'P002'").fetchone() == ("Delhi", 36)
+        assert conn.execute("SELECT 1 FROM patients WHERE id = 'P001'").fetchone() is None
+
+
+def test_shutdown_waits_for_an_in_flight_reload(workdir, monkeypatch):
+    monkeypatch.setattr(patients_main, "RELOAD_INTERVAL", 0.01)
+    running = []
+    data_version = patients_main.data_version
+
+    def slow_data_version():
+        running.append(None)
+        time.sleep(0.2)
+        # the connection must still be open when the check finishes
+        return data_version()
+
+    monkeypatch.setattr(patients_main, "data_version", slow_data_version)
+    with TestClient(patients_main.app):
+        while len(running) < 2:
+            time.sleep(0.01)
+    assert patients_main._reload_task.done()
+    assert patients_main._reload_task.exception() is None
+
+
+def test_sort_orders_asc_and_desc(workdir):
+    with TestClient(patients_main.app) as client:
+        asc = client.get("/sort", params={"sort_by": "age", "order": "asc"}).json()
+        desc = client.get("/sort", params={"sort_by": "age", "order": "desc"}).json()
+
+    assert [row["age"] for row in asc] == [22, 28, 30, 30, 35, 40]
+    assert [row["age"] for row in desc] == [40, 35, 30, 30, 28, 22]
+    # equal ages keep their stored order (P005 before P006) in both directions
+    assert [row["name"] for row in asc if row["age"] == 30] == ["Neha Sinha", "Abhi"]
+    assert [row["name"] for row in desc if row["age"] == 30] == ["Neha Sinha", "Abhi"]
+
+
+def test_sort_rejects_unknown_parameters(workdir):
+    with TestClient(patients_main.app) as client:
+        assert client.get("/sort", params={"sort_by": "name", "order": "asc"}).status_code == 422
+        assert client.get("/sort", params={"sort_by": "age", "order": "up"}).status_code == 422
+
+
+def test_view_etag_round_trip(workdir):
+    with TestClient(patients_main.app) as client:
+        response = client.get("/view")
+        etag = response.headers["etag"]
+        assert response.content == orjson.dumps(patients_main._PATIENTS)
+
+        assert client.get("/view", headers={"if-none-match": etag}).status_code == 304
+        assert client.get("/sort", params={"sort_by": "age", "order": "asc"},
+                          headers={"if-none-match": etag}).status_code == 304
+
+        assert client.delete("/delete_patient/P001").status_code == 200
+        response = client.get("/view", headers={"if-none-match": etag})
+        assert response.status_code == 200
+        assert response.headers["etag"] != etag
+        assert "P001" not in response.json()